@@ -2,12 +2,18 @@
 # -*- coding: utf-8 -*-
 
 import subprocess
+import sys
 import time
-import os
 import threading
+import queue
 import argparse
-import psutil
-import xml.etree.ElementTree as xml_parser
+from dataclasses import dataclass
+try:
+    from lxml import etree as xml_parser #C-backed parser; faster and supports streaming cleanup
+    LXML_AVAILABLE = True
+except ImportError:
+    import xml.etree.ElementTree as xml_parser
+    LXML_AVAILABLE = False
 from dbus import SessionBus
 from dbus.mainloop.glib import DBusGMainLoop
 from gi.repository.GLib import MainLoop
@@ -20,28 +26,51 @@ NOTE: https://github.com/MatMoul/g810-led is required
 
 #Global variables
 
-NOTIFY = "" #Stores last dbus notification name
-SAMPLING = 0.2 #CPU load calculation interval
-SAMPLES = 25 #CPU load cache
+NOTIFY_QUEUE = queue.SimpleQueue() #Carries dbus notification names from the scanner thread to the main loop
+SAMPLING = 0.2 #Default CPU load calculation interval
+SAMPLES = 32 #CPU load cache size; power of two so the cache index wraps with a bitmask
+STEADY_SAMPLING = 1.0 #Relaxed sampling interval used while the CPU load is steady
+STEADY_TICKS = 10 #Consecutive steady samples before relaxing the sampling interval
+DRAW_INTERVAL = 0.5 #Minimum time between verbose redraws
 NOTIFICATION_SETTINGS_FILE = "notifications.xml" #Notification settings file path
 NOTIFICATION_SETTINGS_MANDATORY_ATTRIBUTES = ("name", "color", "count", "interval") #Mandatory attributes of each notification setting, to be read from XML file
 
 #General purpose functions
 
 def limit(min_thr, max_thr, number):
-    return max(min(number, max_thr), min_thr)
+    #Conditional expression instead of max(min(...)): no nested call frames
+    return min_thr if number < min_thr else max_thr if number > max_thr else number
 
-def int_to_hexstring(dec):
+def read_cpu_times():
     """
-    Returns a string containing the hexadecimal value of the passed integer
+    Reads the aggregate cpu line from /proc/stat
+    Returns an (idle, total) jiffies tuple; CPU load is computed from the
+    deltas between successive reads
     """
-    out = str(hex(dec))[2:] #'\xff' to 'ff'
-    if ((len(out) % 2) != 0): #Adds '0' if number of characters is odd
-        out = "0" + out
-    return out.upper()
+    with open("/proc/stat") as stat_file:
+        times = list(map(int, stat_file.readline().split()[1:]))
+    return times[3] + times[4], sum(times) #idle + iowait, total
 
 #Keyboard color change functions
 
+G810_PIPE = None #Persistent g810-led process fed over stdin, if pipe mode is available
+
+def start_g810_pipe():
+    """
+    Spawns a persistent g810-led process in pipe mode ('-pp')
+    Colors are then streamed over its stdin instead of fork+exec'ing g810-led on every change
+    Leaves G810_PIPE as None (per-call fallback) if pipe mode could not be started
+    """
+    global G810_PIPE
+    try:
+        G810_PIPE = subprocess.Popen(["g810-led", "-pp"], stdin = subprocess.PIPE, stdout = subprocess.DEVNULL)
+    except FileNotFoundError:
+        print("Program g810-led not found; install it from https://github.com/MatMoul/g810-led")
+        exit()
+    except OSError:
+        G810_PIPE = None
+    return G810_PIPE
+
 def get_load_color(percentage):
     """
     Returns an RGB value array (0-255) based on green-red scale
@@ -55,14 +84,31 @@ def get_load_color(percentage):
         rgb[i] = int(limit(0, 1, rgb[i]) * 255 ) #Transforms 0-1 value in 0-255 values
     return rgb
 
-def set_keyboard_color(rgb, ignore_errors=0):
+def send_color_string(color_string, ignore_errors=0):
     """
-    Calls g810-led with rgb values as argument
+    Sends an 'RRGGBB' color string to g810-led (persistent pipe if available)
     If an error occurs, gives warning and stops script
     """
-    color_string = "" #String used by g810-led to set color
-    for color in rgb:
-        color_string += int_to_hexstring(limit(0, 255, color))
+    if color_string == send_color_string.last: #Skips sending if the color would not change
+        return
+    global G810_PIPE
+    if G810_PIPE is not None: #Streams the color through the persistent pipe ('a RRGGBB' + commit)
+        try:
+            G810_PIPE.stdin.write(("a " + color_string + "\nc\n").encode())
+            G810_PIPE.stdin.flush()
+        except (BrokenPipeError, OSError):
+            if start_g810_pipe() is None: #Respawns the pipe; stays on per-call mode if that fails too
+                send_color_string(color_string, ignore_errors)
+                return
+            try:
+                G810_PIPE.stdin.write(("a " + color_string + "\nc\n").encode())
+                G810_PIPE.stdin.flush()
+            except (BrokenPipeError, OSError): #Pipe mode unsupported; falls back to per-call mode
+                G810_PIPE = None
+                send_color_string(color_string, ignore_errors)
+                return
+        send_color_string.last = color_string
+        return
     try:
         subprocess.check_output(["g810-led", "-a", color_string])
     except FileNotFoundError:
@@ -72,26 +118,41 @@ def set_keyboard_color(rgb, ignore_errors=0):
         if not ignore_errors:
             print("Program g810-led failed; check keyboard connection")
             exit()
+    else:
+        send_color_string.last = color_string
+send_color_string.last = None #Last color string successfully sent to the keyboard
 
-def notification_blink(color1, color2=[0,0,0], count=2, interval=0.2):
+#Lookup tables mapping each integer load percentage (0-100) to its precomputed color
+#The hot loop then indexes them instead of redoing the color math on every sample
+RGB_LUT = [get_load_color(load) for load in range(101)]
+COLOR_LUT = [f"{red:02X}{green:02X}{blue:02X}" for red, green, blue in RGB_LUT]
+
+def notification_blink(color1, color2="000000", count=2, interval=0.2):
     """
-    Calls set_keyboard_color to make the keyboard blink in two different colors
+    Calls send_color_string to make the keyboard blink in two different colors
+    Colors are 'RRGGBB' strings
+    Phases are paced by monotonic deadlines, so the time spent sending a color
+    does not stretch the visible blink period
     """
-    for i in range(count):
-        set_keyboard_color(color1)
-        time.sleep(interval)
-        set_keyboard_color(color2)
-        time.sleep(interval)
+    colors = (color1, color2)
+    deadline = time.monotonic()
+    for i in range(2 * count):
+        deadline += interval
+        send_color_string(colors[i & 1])
+        time.sleep(max(0, deadline - time.monotonic()))
 
 #Notifications management functions
 
 def notification_event(bus, message):
     """
     Function to be called by the dbus scanner
-    Updates the 'NOTIFY' global variable with last notification name
+    Puts the notification name on NOTIFY_QUEUE, waking up the main loop
     """
-    global NOTIFY
-    NOTIFY = message.get_args_list()[0]
+    #A message filter sees all bus traffic; checks the cheap header fields first
+    #so argument unpacking only runs for actual Notify calls
+    if message.get_interface() != "org.freedesktop.Notifications" or message.get_member() != "Notify":
+        return
+    NOTIFY_QUEUE.put(str(message.get_args_list()[0]))
 
 def notification_scanner():
     """
@@ -100,14 +161,26 @@ def notification_scanner():
     """
     DBusGMainLoop(set_as_default=True)
     bus = SessionBus()
-    bus.add_match_string_non_blocking("eavesdrop=true, interface='org.freedesktop.Notifications', member='Notify'")
+    bus.add_match_string_non_blocking("eavesdrop=true, type='method_call', interface='org.freedesktop.Notifications', member='Notify'")
     bus.add_message_filter(notification_event)
     mainloop = MainLoop()
     mainloop.run()
 
+@dataclass(slots=True)
+class NotificationSettings:
+    """
+    Settings for one notification type, as read from the XML file
+    color_hex is the precomputed g810-led color string
+    """
+    name: str
+    color: tuple
+    count: int
+    interval: float
+    color_hex: str
+
 def parse_notification_settings_from_xml(path):
     """
-    Parses notification settings from an XML file into a dictionary list
+    Parses notification settings from an XML file into a dict keyed by notification name
     Interval is expressed in seconds
     XML file example:
     <notifications>
@@ -127,27 +200,37 @@ def parse_notification_settings_from_xml(path):
     """
     #Setup variables
     global NOTIFICATION_SETTINGS_MANDATORY_ATTRIBUTES
-    out_list = list()
-    for notification_settings_node in xml_parser.parse(path).iterfind('notification'): 
-        notification_settings_object = dict() #Will contain all attributes
-        #Assign object's values from XML element
-        for element in notification_settings_node:
-            if element.tag == "name":
-                notification_settings_object["name"] = element.text
-            elif element.tag == "color":
-                notification_settings_object["color"] = tuple(map(int, element.text.split(",")))
-            elif element.tag == "count":
-                notification_settings_object["count"] = int(element.text)
-            elif element.tag == "interval":
-                notification_settings_object["interval"] = float(element.text)
-        #Check if object has all required keys
-        for attribute in NOTIFICATION_SETTINGS_MANDATORY_ATTRIBUTES:
-            if not (attribute in notification_settings_object):
+    out_dict = dict()
+    if LXML_AVAILABLE: #lxml can filter by tag at C level
+        node_iterator = xml_parser.iterparse(path, tag = "notification")
+    else:
+        node_iterator = xml_parser.iterparse(path)
+    for _, notification_settings_node in node_iterator:
+        if notification_settings_node.tag != "notification":
+            continue
+        #Extracts the mandatory fields in one pass, checking presence as it goes
+        texts = [notification_settings_node.findtext(attribute) for attribute in NOTIFICATION_SETTINGS_MANDATORY_ATTRIBUTES]
+        for attribute, text in zip(NOTIFICATION_SETTINGS_MANDATORY_ATTRIBUTES, texts):
+            if text is None:
                 raise ValueError("Missing element in notification settings XML: " + attribute)
-        #Appends checked element to notification settings list
-        out_list.append(notification_settings_object)
-    #Returns filled list    
-    return out_list
+        name, color_text, count_text, interval_text = texts
+        color = tuple(map(int, color_text.split(",")))
+        #color_hex is precomputed so the blink path never re-hexes it
+        notification_settings_object = NotificationSettings(
+            name = name,
+            color = color,
+            count = int(count_text),
+            interval = float(interval_text),
+            color_hex = "".join(f"{channel:02X}" for channel in color))
+        #Stores checked element by name for O(1) dispatch
+        out_dict[name] = notification_settings_object
+        #Frees the parsed element (and consumed siblings) so the parse stays streaming
+        notification_settings_node.clear()
+        if LXML_AVAILABLE:
+            while notification_settings_node.getprevious() is not None:
+                del notification_settings_node.getparent()[0]
+    #Returns filled dict
+    return out_dict
     
 #Main
 
@@ -157,46 +240,92 @@ if __name__ == "__main__":
     argparser.add_argument("-verbose", type = int, nargs = '?', const = 1, default = 0, help = "Text output")
     argparser.add_argument("-persistent", type = int, nargs = '?', const = 1, default = 0, help = "Keep running if keyboard disconnected")
     argparser.add_argument("-notify", type = int, nargs = '?', const = 1, default = 0, help = "Enable notification blink")
+    argparser.add_argument("-sampling", type = float, default = SAMPLING, help = "CPU load calculation interval in seconds")
     args=argparser.parse_args()
+    if args.sampling <= 0:
+        print("Sampling interval must be a positive number of seconds")
+        exit()
+    SAMPLING = args.sampling
     #Setup variables
+    start_g810_pipe()
     cpu_load_cache = [50] * SAMPLES
+    running_sum = 50 * SAMPLES #Kept in sync with the cache so the average is a single division
     current_sampling = 0
-    notification_settings_list = list()
+    notification_settings = dict()
     #Starts dbus notifications scanner daemon, if requested
     if args.notify:
         try:
-            notification_settings_list = parse_notification_settings_from_xml(NOTIFICATION_SETTINGS_FILE)
+            notification_settings = parse_notification_settings_from_xml(NOTIFICATION_SETTINGS_FILE)
             threading.Thread(target = notification_scanner, daemon = True).start()   
         except Exception as e:
             print("Error in executing notification monitoring setup; check notification setting file")
             print(repr(e))
             exit()
+    load_index = 50 #Neutral blink background before the first CPU sample
+    last_drawn_index = None #Load percentage shown by the last verbose redraw
+    next_draw = 0.0 #Earliest monotonic time for the next verbose redraw
+    #Hoists hot-loop lookups into locals (LOAD_FAST instead of attribute/global lookups)
+    verbose = args.verbose
+    persistent = args.persistent
+    sampling = SAMPLING
+    steady_sampling = STEADY_SAMPLING
+    steady_ticks = STEADY_TICKS
+    samples = SAMPLES
+    sample_mask = SAMPLES - 1
+    read_cpu = read_cpu_times
+    notify_get = NOTIFY_QUEUE.get
+    previous_idle, previous_total = read_cpu() #Baseline for the first load delta
+    interval = sampling #Current sampling interval; relaxed while the load is steady
+    last_load = 50.0
+    steady_count = 0
     #Main loop
-    while True:    
-        if NOTIFY == "": #If no notification present, sets color based on CPU load
-            #Updates CPU load cache
-            cpu_load_cache[current_sampling] = (int(psutil.cpu_percent()))
-            current_sampling += 1
-            if current_sampling >= len(cpu_load_cache):
-                current_sampling = 0
+    while True:
+        try: #Waits for a notification for one sampling interval; doubles as the sampling sleep
+            notify_name = notify_get(timeout = interval)
+        except queue.Empty:
+            notify_name = None
+        if notify_name is None: #If no notification present, sets color based on CPU load
+            #Updates CPU load cache from the /proc/stat delta since the last read
+            idle, total = read_cpu()
+            total_delta = total - previous_total
+            if total_delta > 0:
+                new_sample = 100 * (total_delta - (idle - previous_idle)) / total_delta
+                previous_idle, previous_total = idle, total
+            else: #No jiffy elapsed since the last read; repeats the previous sample
+                new_sample = cpu_load_cache[(current_sampling - 1) & sample_mask]
+            running_sum += new_sample - cpu_load_cache[current_sampling]
+            cpu_load_cache[current_sampling] = new_sample
+            current_sampling = (current_sampling + 1) & sample_mask
             #Gets current load (average from cache) and corresponding RGB value
-            cpu_load = sum(cpu_load_cache) / len(cpu_load_cache)
-            meter_color = get_load_color(cpu_load)
-            #Sets keyboard color and sleeps for sampling time
-            set_keyboard_color(meter_color, args.persistent) 
-            #Prints output, if requested
-            if args.verbose:
-                os.system("clear")
-                print("G Series Keyboard control")
-                print("R: {:3} G: {:3} B: {:3}".format(*meter_color))
-                print("CPU LOAD: {:.2f}%".format(cpu_load))
-            #Sleeps for sampling time
-            time.sleep(SAMPLING)
+            cpu_load = running_sum / samples
+            #Backs off the sampling rate while the load is steady, cutting wakeups on idle systems
+            if abs(cpu_load - last_load) < 1:
+                steady_count += 1
+            else:
+                steady_count = 0
+            last_load = cpu_load
+            interval = steady_sampling if steady_count > steady_ticks else sampling
+            load_index = int(cpu_load)
+            meter_color = RGB_LUT[load_index]
+            #Sets keyboard color from the precomputed tables
+            send_color_string(COLOR_LUT[load_index], persistent)
+            #Prints output, if requested; redraws only when the shown percentage changed,
+            #and no faster than the terminal is worth refreshing
+            if verbose and load_index != last_drawn_index:
+                now = time.monotonic()
+                if now >= next_draw:
+                    sys.stdout.write("\x1b[H\x1b[2J") #ANSI clear; avoids spawning a shell for 'clear'
+                    print("G Series Keyboard control")
+                    print("R: {:3} G: {:3} B: {:3}".format(*meter_color))
+                    print("CPU LOAD: {:.2f}%".format(cpu_load))
+                    last_drawn_index = load_index
+                    next_draw = now + DRAW_INTERVAL
         else: #If notification present; executes notification blink (if notification is defined)
-            if args.verbose:
-                print("Notification active: " + NOTIFY)
-            for notification in notification_settings_list:
-                if NOTIFY==notification["name"]:
-                    notification_blink(notification["color"], meter_color,notification["count"], notification["interval"])
-                    break
-            NOTIFY = "" #Empties last notification name variable       
+            if verbose:
+                print("Notification active: " + notify_name)
+            notification = notification_settings.get(notify_name)
+            if notification is not None:
+                notification_blink(notification.color_hex, COLOR_LUT[load_index], notification.count, notification.interval)
+            #Resumes fast sampling; a notification usually means the system is active again
+            steady_count = 0
+            interval = sampling